@@ -5,21 +5,32 @@ Generates random sensor data every 10 seconds.
 """
 
 import http.server
-import socketserver
 import json
 import random
 import threading
 import time
+from collections import deque
 from datetime import datetime
 from pathlib import Path
 
+try:
+    import orjson  # Optional faster JSON encoder
+except ImportError:
+    orjson = None
+
 HOST = '127.0.0.1'
 PORT = 8888
 BASE_DIR = Path(__file__).resolve().parent
 
 # Simulated sensor data storage
 sensor_data = []
-alerts = []
+alerts = deque(maxlen=10)  # Newest first, keeps only last 10 alerts
+
+# Shared random generator (bound methods looked up once per tick)
+_rng = random.Random()
+
+# Polled API paths left out of the access log
+QUIET_PATHS = frozenset({'/data', '/api/alerts'})
 
 # Node configurations
 NODES = [
@@ -29,25 +40,39 @@ NODES = [
 ]
 
 
+def _make_alert(timestamp, node_id, alert_type, message):
+    """Build an unacknowledged alert entry."""
+    return {
+        "timestamp": timestamp,
+        "node_id": node_id,
+        "alert_type": alert_type,
+        "message": message,
+        "acknowledged": False
+    }
+
+
 def generate_random_data():
     """Generate random sensor data for all nodes."""
-    global sensor_data, alerts
+    global sensor_data
     
     new_data = []
     timestamp = datetime.utcnow().isoformat() + "Z"
+    uniform = _rng.uniform
+    randint = _rng.randint
     
     for node in NODES:
+        node_id = node["id"]
         # Random sensor values
-        temperature = random.uniform(15, 40)  # Temperature °C
-        humidity = random.uniform(15, 95)  # Soil moisture %
-        distance = random.randint(5, 200)  # Distance cm
-        luminosity = random.randint(50, 15000)  # Luminosity lux
-        battery = random.randint(20, 100)  # Battery %
-        rssi = random.randint(-120, -40)   # RSSI dBm
-        snr = random.uniform(-5, 15)       # SNR dB
+        temperature = uniform(15, 40)  # Temperature °C
+        humidity = uniform(15, 95)  # Soil moisture %
+        distance = randint(5, 200)  # Distance cm
+        luminosity = randint(50, 15000)  # Luminosity lux
+        battery = randint(20, 100)  # Battery %
+        rssi = randint(-120, -40)   # RSSI dBm
+        snr = uniform(-5, 15)       # SNR dB
         
-        entry = {
-            "node_id": node["id"],
+        new_data.append({
+            "node_id": node_id,
             "timestamp": timestamp,
             "sensors": {
                 "temperature_celsius": temperature,
@@ -60,45 +85,18 @@ def generate_random_data():
                 "rssi_dbm": rssi,
                 "snr_db": snr,
             }
-        }
-        new_data.append(entry)
+        })
         
         # Generate alerts for critical conditions
         if humidity < 20:
-            alerts.insert(0, {
-                "timestamp": timestamp,
-                "node_id": node["id"],
-                "alert_type": "LOW_MOISTURE",
-                "message": f"Low soil moisture: {humidity:.1f}%",
-                "acknowledged": False
-            })
+            alerts.appendleft(_make_alert(timestamp, node_id, "LOW_MOISTURE", f"Low soil moisture: {humidity:.1f}%"))
         if battery < 25:
-            alerts.insert(0, {
-                "timestamp": timestamp,
-                "node_id": node["id"],
-                "alert_type": "LOW_BATTERY",
-                "message": f"Low battery: {battery}%",
-                "acknowledged": False
-            })
+            alerts.appendleft(_make_alert(timestamp, node_id, "LOW_BATTERY", f"Low battery: {battery}%"))
         if rssi < -100:
-            alerts.insert(0, {
-                "timestamp": timestamp,
-                "node_id": node["id"],
-                "alert_type": "WEAK_SIGNAL",
-                "message": f"Weak LoRa signal: {rssi} dBm",
-                "acknowledged": False
-            })
+            alerts.appendleft(_make_alert(timestamp, node_id, "WEAK_SIGNAL", f"Weak LoRa signal: {rssi} dBm"))
         if temperature > 35:
-            alerts.insert(0, {
-                "timestamp": timestamp,
-                "node_id": node["id"],
-                "alert_type": "HIGH_TEMP",
-                "message": f"High temperature: {temperature:.1f}°C",
-                "acknowledged": False
-            })
+            alerts.appendleft(_make_alert(timestamp, node_id, "HIGH_TEMP", f"High temperature: {temperature:.1f}°C"))
     
-    # Keep only last 10 alerts
-    alerts = alerts[:10]
     sensor_data = new_data
     
     print(f"[{datetime.now().strftime('%H:%M:%S')}] Generated data for {len(NODES)} nodes")
@@ -117,32 +115,34 @@ class MockHandler(http.server.SimpleHTTPRequestHandler):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, directory=str(BASE_DIR), **kwargs)
     
+    def _send_json(self, status, obj):
+        """Send a JSON response with Content-Length and CORS headers."""
+        data = orjson.dumps(obj) if orjson is not None else json.dumps(obj).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.send_header('Access-Control-Allow-Origin', '*')
+        self.end_headers()
+        self.wfile.write(data)
+    
     def do_GET(self):
         # API: Get sensor data
         if self.path == '/data':
-            self.send_response(200)
-            self.send_header('Content-Type', 'application/json')
-            self.send_header('Access-Control-Allow-Origin', '*')
-            self.end_headers()
-            self.wfile.write(json.dumps(sensor_data).encode())
+            self._send_json(200, sensor_data)
             return
         
         # API: Get alerts
         if self.path == '/api/alerts':
-            self.send_response(200)
-            self.send_header('Content-Type', 'application/json')
-            self.send_header('Access-Control-Allow-Origin', '*')
-            self.end_headers()
-            self.wfile.write(json.dumps(alerts).encode())
+            self._send_json(200, list(alerts))
             return
         
         # Serve static files (dashboard.html, style.css, etc.)
         return super().do_GET()
     
-    def log_message(self, format, *args):
+    def log_request(self, code='-', size='-'):
         # Quieter logging - only log non-data requests
-        if '/data' not in args[0] and '/api/alerts' not in args[0]:
-            super().log_message(format, *args)
+        if self.path not in QUIET_PATHS:
+            super().log_request(code, size)
 
 
 def main():
@@ -164,7 +164,7 @@ def main():
     thread.start()
     
     # Start HTTP server
-    with socketserver.TCPServer((HOST, PORT), MockHandler) as httpd:
+    with http.server.ThreadingHTTPServer((HOST, PORT), MockHandler) as httpd:
         try:
             httpd.serve_forever()
         except KeyboardInterrupt:
@@ -4,13 +4,29 @@ Server for receiving sensor data from LoRa Gateway
 Compatible with both old mock client and new LoRa gateway
 """
 
+import atexit
+import functools
 import http.server
-import socketserver
 import json
+import logging
+import logging.handlers
+import math
+import queue
 import sqlite3
+import threading
+import time
+from collections import deque
+from contextlib import closing, contextmanager
 from pathlib import Path
-from datetime import datetime, timedelta
-from typing import Any, Dict, List
+from datetime import datetime, timedelta, timezone
+from urllib.parse import parse_qs, urlsplit
+from itertools import islice
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple, Union
+
+try:
+    import orjson  # Serializador JSON em Rust, opcional
+except ImportError:
+    orjson = None
 
 BASE_DIR = Path(__file__).resolve().parent
 DB_NAME = 'environmental_data.db'
@@ -18,96 +34,459 @@ DB_PATH = BASE_DIR / DB_NAME
 HOST = '0.0.0.0'
 PORT = 8080
 
+logger = logging.getLogger('server')
+logger.addHandler(logging.NullHandler())
+
+# Nível de log do servidor; DEBUG mostra o detalhe de cada leitura recebida
+LOG_LEVEL = logging.INFO
+LOG_FORMAT = '%(asctime)s %(levelname)s %(name)s: %(message)s'
+
+# Tamanho dos blocos ao escrever corpos de resposta grandes
+RESPONSE_CHUNK_SIZE = 64 * 1024
+
+# Maior corpo de POST aceito; payloads de sensores têm poucos KB
+MAX_BODY = 1 << 20
+
+# Limite de entradas por função em cache (ex.: valores distintos de ?hours=)
+TTL_CACHE_MAX_ENTRIES = 64
+
 gateway_stats_cache: Dict[int, Dict[str, Any]] = {}
 server_start_time: datetime = None  # Tempo de início do servidor
+server_start_epoch_us: int = None  # O mesmo instante em microssegundos desde a época (UTC)
+
+# Linhas por executemany ao gravar lotes de sensores
+SENSOR_BATCH_CHUNK = 500
+
+# Faixa de INTEGER do SQLite (64 bits com sinal)
+SQLITE_INT_MIN = -(1 << 63)
+SQLITE_INT_MAX = (1 << 63) - 1
+
+# /api/history: pontos máximos por janela e largura mínima do intervalo de média
+HISTORY_MAX_POINTS = 1440
+HISTORY_MIN_BUCKET_S = 60
+HISTORY_MAX_HOURS = 24 * 366  # Janela máxima aceita em ?hours= (um ano)
+
+# Conexões SQLite mantidas abertas para reuso entre requisições
+DB_POOL_SIZE = 4
+_connection_pool: 'queue.LifoQueue[sqlite3.Connection]' = queue.LifoQueue(maxsize=DB_POOL_SIZE)
+# Um único escritor por vez; leitores seguem em paralelo graças ao WAL
+_write_lock = threading.Lock()
+
+# Manutenção periódica: checkpoint do WAL (mantém o arquivo -wal pequeno) e PRAGMA optimize
+MAINTENANCE_INTERVAL_S = 60
+_maintenance_stop = threading.Event()
+
+# Estatísticas do gateway são telemetria de baixo valor: acumuladas em memória
+# e gravadas em lote a cada GATEWAY_FLUSH_ROWS linhas ou GATEWAY_FLUSH_INTERVAL_S segundos
+GATEWAY_FLUSH_ROWS = 50
+GATEWAY_FLUSH_INTERVAL_S = 30
+_gateway_stats_buffer: 'deque[Tuple[Any, ...]]' = deque()
+_gateway_flush_stop = threading.Event()
+_gateway_stats_lock = threading.Lock()  # Protege gateway_stats_cache entre as threads de requisição
+
+# Amostras de sensores são gravadas por uma thread dedicada; o POST só enfileira
+SENSOR_QUEUE_MAXSIZE = 10000
+SENSOR_WRITER_BATCH = 100
+sensor_write_queue: 'queue.Queue[Tuple[List[Tuple[Any, ...]], List[Tuple[Any, ...]]]]' = queue.Queue(
+    maxsize=SENSOR_QUEUE_MAXSIZE)
+
+SCHEMA_SQL = '''
+    CREATE TABLE IF NOT EXISTS sensor_data (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        node_id TEXT NOT NULL,
+        timestamp TEXT NOT NULL,
+        temperature_celsius REAL,
+        humidity_percent REAL,
+        distance_cm INTEGER,
+        luminosity_lux INTEGER,
+        presence_detected BOOLEAN,
+        battery_percent INTEGER,
+        rssi_dbm REAL,
+        snr_db REAL,
+        gateway_id INTEGER
+    );
+    CREATE TABLE IF NOT EXISTS gateway_stats (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        gateway_id INTEGER NOT NULL,
+        timestamp TEXT NOT NULL,
+        uptime_seconds INTEGER,
+        rx_total INTEGER,
+        rx_valid INTEGER,
+        rx_invalid INTEGER,
+        rx_checksum_error INTEGER,
+        packet_loss_percent REAL,
+        tx_total INTEGER,
+        tx_success INTEGER,
+        tx_failed INTEGER,
+        server_success_rate REAL,
+        latency_avg_ms REAL,
+        latency_min_ms INTEGER,
+        latency_max_ms INTEGER,
+        latency_last_ms INTEGER,
+        energy_mah REAL,
+        wifi_rssi INTEGER
+    );
+    CREATE TABLE IF NOT EXISTS alerts (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        timestamp TEXT NOT NULL,
+        node_id TEXT,
+        alert_type TEXT NOT NULL,
+        message TEXT NOT NULL,
+        acknowledged BOOLEAN DEFAULT 0
+    );
+
+    -- Índices para os ORDER BY timestamp / WHERE timestamp >= ? das consultas fetch_*
+    -- (o de sensor_data cobre todas as colunas lidas por SELECT_HISTORY_SQL)
+    CREATE INDEX IF NOT EXISTS idx_sensor_ts
+        ON sensor_data(timestamp, humidity_percent, distance_cm, battery_percent);
+    CREATE INDEX IF NOT EXISTS idx_alerts_ts ON alerts(timestamp);
+    CREATE INDEX IF NOT EXISTS idx_alerts_ack_ts ON alerts(acknowledged, timestamp);
+    CREATE INDEX IF NOT EXISTS idx_gw_stats ON gateway_stats(gateway_id, timestamp);
+'''
+
+# journal_mode=WAL fica gravado no arquivo (initialize_database);
+# os demais PRAGMAs valem apenas para a conexão atual
+CONNECTION_PRAGMAS_SQL = '''
+    PRAGMA synchronous=NORMAL;
+    PRAGMA temp_store=MEMORY;
+    PRAGMA mmap_size=268435456;
+    PRAGMA cache_size=-64000;
+    PRAGMA wal_autocheckpoint=1000;
+'''
+
+INSERT_SENSOR_SQL = '''
+    INSERT INTO sensor_data (
+        node_id, timestamp, temperature_celsius, humidity_percent, distance_cm,
+        luminosity_lux, presence_detected, battery_percent, rssi_dbm, snr_db, gateway_id
+    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+'''
+
+# Nomes das colunas na ordem dos INSERTs, usados nas mensagens de check_row
+SENSOR_COLUMNS = (
+    'node_id', 'timestamp', 'temperature_celsius', 'humidity_percent', 'distance_cm',
+    'luminosity_lux', 'presence_detected', 'battery_percent', 'rssi_dbm', 'snr_db', 'gateway_id'
+)
+
+INSERT_ALERT_SQL = '''
+    INSERT INTO alerts (timestamp, node_id, alert_type, message)
+    VALUES (?, ?, ?, ?)
+'''
+
+INSERT_GATEWAY_SQL = '''
+    INSERT INTO gateway_stats (
+        gateway_id, timestamp, uptime_seconds,
+        rx_total, rx_valid, rx_invalid, rx_checksum_error, packet_loss_percent,
+        tx_total, tx_success, tx_failed, server_success_rate,
+        latency_avg_ms, latency_min_ms, latency_max_ms, latency_last_ms,
+        energy_mah, wifi_rssi
+    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+'''
+
+GATEWAY_COLUMNS = (
+    'gateway_id', 'timestamp', 'uptime_seconds',
+    'rx_total', 'rx_valid', 'rx_invalid', 'rx_checksum_error', 'packet_loss_percent',
+    'tx_total', 'tx_success', 'tx_failed', 'server_success_rate',
+    'latency_avg_ms', 'latency_min_ms', 'latency_max_ms', 'latency_last_ms',
+    'energy_mah', 'wifi_rssi'
+)
+
+SELECT_RECENT_SQL = '''
+    SELECT 
+        node_id, timestamp, temperature_celsius, humidity_percent, distance_cm,
+        luminosity_lux, presence_detected, battery_percent, rssi_dbm, snr_db, gateway_id
+    FROM sensor_data 
+    ORDER BY timestamp DESC 
+    LIMIT ?
+'''
+
+# Mesmo formato de fetch_recent_data, montado pelo próprio SQLite (JSON1)
+SELECT_RECENT_JSON_SQL = '''
+    SELECT json_object(
+        'node_id', node_id,
+        'timestamp', timestamp,
+        'sensors', json_object(
+            'temperature_celsius', temperature_celsius,
+            'humidity_percent', humidity_percent,
+            'distance_cm', distance_cm,
+            'luminosity_lux', luminosity_lux,
+            'presence_detected', json(CASE WHEN presence_detected THEN 'true' ELSE 'false' END),
+            'rssi_dbm', rssi_dbm,
+            'snr_db', snr_db
+        ),
+        'battery_percent', battery_percent,
+        'gateway_id', gateway_id
+    )
+    FROM sensor_data
+    ORDER BY timestamp DESC
+    LIMIT ?
+'''
+
+SELECT_HISTORY_SQL = '''
+    SELECT timestamp, humidity_percent, distance_cm, battery_percent
+    FROM sensor_data
+    WHERE timestamp >= ?
+    ORDER BY timestamp ASC
+'''
+
+# Médias por intervalo de bucket_seconds (parâmetros: bucket, bucket, since)
+SELECT_HISTORY_BUCKETED_SQL = '''
+    SELECT strftime('%Y-%m-%dT%H:%M:%S', CAST(strftime('%s', timestamp) AS INTEGER) / ? * ?, 'unixepoch') AS bucket,
+           ROUND(AVG(humidity_percent), 2), ROUND(AVG(distance_cm), 2), ROUND(AVG(battery_percent), 2)
+    FROM sensor_data
+    WHERE timestamp >= ?
+    GROUP BY bucket
+    ORDER BY bucket ASC
+'''
+
+SELECT_GW_HISTORY_SQL = '''
+    SELECT timestamp, uptime_seconds, rx_total, rx_valid, rx_invalid,
+           packet_loss_percent, latency_avg_ms, energy_mah
+    FROM gateway_stats
+    WHERE gateway_id = ?
+    ORDER BY timestamp DESC
+    LIMIT ?
+'''
+
+# Última linha de cada gateway (colunas "nuas" vêm da linha do MAX no SQLite),
+# na ordem de GATEWAY_COLUMNS
+SELECT_GW_LATEST_SQL = '''
+    SELECT gateway_id, MAX(timestamp) AS timestamp, uptime_seconds,
+           rx_total, rx_valid, rx_invalid, rx_checksum_error, packet_loss_percent,
+           tx_total, tx_success, tx_failed, server_success_rate,
+           latency_avg_ms, latency_min_ms, latency_max_ms, latency_last_ms,
+           energy_mah, wifi_rssi
+    FROM gateway_stats
+    GROUP BY gateway_id
+'''
+
+# Duas consultas fixas (em vez de concatenar a string) para reaproveitar o cache de statements
+SELECT_ALERTS_SQL = '''
+    SELECT id, timestamp, node_id, alert_type, message, acknowledged
+    FROM alerts
+    ORDER BY timestamp DESC LIMIT ?
+'''
+
+SELECT_ALERTS_UNACK_SQL = '''
+    SELECT id, timestamp, node_id, alert_type, message, acknowledged
+    FROM alerts
+    WHERE acknowledged = 0
+    ORDER BY timestamp DESC LIMIT ?
+'''
+
+ACKNOWLEDGE_ALERT_SQL = 'UPDATE alerts SET acknowledged = 1 WHERE id = ?'
+
+COUNT_ACTIVE_NODES_SQL = 'SELECT COUNT(DISTINCT node_id) FROM sensor_data'
+
+API_INFO_HTML = b"""
+            <html>
+            <head><title>API Endpoint</title></head>
+            <body>
+                <h1>Sensor Data API</h1>
+                <p>This endpoint accepts POST requests with sensor data.</p>
+                <p>Send data in JSON format to: <code>POST /api/sensor-data</code></p>
+                <p><a href="/data">View recent data (GET /data)</a></p>
+            </body>
+            </html>
+            """
+
+# Corpos JSON constantes, serializados uma única vez
+HEALTH_BODY = b'{"status":"ok"}'
+SUCCESS_BODY = b'{"status":"success"}'
+GATEWAY_STATS_OK_BODY = b'{"status":"success","message":"Stats received"}'
+
+
+# Fallback sem orjson: encoder compacto criado uma vez. Equivalente ao orjson para os
+# dados do servidor, mas não idêntico byte a byte (ex.: 1e+16 contra 1e16);
+# allow_nan=False evita emitir NaN/Infinity, que não são JSON válido
+_json_encoder = json.JSONEncoder(separators=(',', ':'), ensure_ascii=False, allow_nan=False)
+
+
+def _replace_non_finite(obj: Any) -> Any:
+    """Replace NaN/Infinity floats with None, as orjson does"""
+    if isinstance(obj, float):
+        return obj if math.isfinite(obj) else None
+    if isinstance(obj, dict):
+        return {key: _replace_non_finite(value) for key, value in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [_replace_non_finite(value) for value in obj]
+    return obj
+
+
+def dumps_json(obj: Any) -> bytes:
+    """Serialize a response body to JSON bytes, using orjson when installed"""
+    if orjson is not None:
+        return orjson.dumps(obj)
+    try:
+        return _json_encoder.encode(obj).encode('utf-8')
+    except ValueError:
+        # Leitura NaN/Infinity: refazer com null no lugar (caminho raro)
+        return _json_encoder.encode(_replace_non_finite(obj)).encode('utf-8')
+
+
+def loads_json(data: Union[bytes, bytearray]) -> Any:
+    """Parse a request body, using orjson when installed
+    
+    Malformed input raises ValueError either way: orjson.JSONDecodeError and
+    json.JSONDecodeError subclass it, and so does the UnicodeDecodeError that
+    json.loads raises on a non-UTF-8 body.
+    """
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+class BadRequest(Exception):
+    """Raised by route handlers for invalid client input (sent as 400)"""
+
+
+def _open_connection() -> sqlite3.Connection:
+    """Open a SQLite connection tuned for the server workload"""
+    connection = sqlite3.connect(DB_PATH, check_same_thread=False, cached_statements=256)
+    connection.executescript(CONNECTION_PRAGMAS_SQL)
+    return connection
+
+
+@contextmanager
+def get_connection() -> Iterator[sqlite3.Connection]:
+    """Check out a pooled connection, returning it to the pool afterwards"""
+    try:
+        connection = _connection_pool.get_nowait()
+    except queue.Empty:
+        connection = _open_connection()
+    try:
+        yield connection
+    finally:
+        if connection.in_transaction:
+            connection.rollback()
+        try:
+            _connection_pool.put_nowait(connection)
+        except queue.Full:
+            connection.close()
+
+
+def close_pooled_connections() -> None:
+    """Close every idle pooled connection (registered with atexit)"""
+    while True:
+        try:
+            connection = _connection_pool.get_nowait()
+        except queue.Empty:
+            break
+        try:
+            connection.execute('PRAGMA optimize')
+        except sqlite3.Error as e:
+            logger.warning('PRAGMA optimize failed on close: %s', e)
+        connection.close()
+
+
+atexit.register(close_pooled_connections)
+
+
+@contextmanager
+def get_write_connection() -> Iterator[sqlite3.Connection]:
+    """Check out a pooled connection inside a write transaction (commits on exit)"""
+    with _write_lock, get_connection() as connection, connection:
+        yield connection
+
+
+def run_maintenance() -> None:
+    """Checkpoint and truncate the WAL, then refresh planner statistics"""
+    # Sob o lock de escrita para não disputar com o escritor ativo
+    with _write_lock, get_connection() as connection:
+        busy, wal_pages, checkpointed = connection.execute('PRAGMA wal_checkpoint(TRUNCATE)').fetchone()
+        connection.execute('PRAGMA optimize')
+    if busy:
+        logger.debug('WAL checkpoint blocked by readers (%d/%d pages)', checkpointed, wal_pages)
+
+
+def _maintenance_loop() -> None:
+    """Background loop running run_maintenance every MAINTENANCE_INTERVAL_S"""
+    while not _maintenance_stop.wait(MAINTENANCE_INTERVAL_S):
+        try:
+            run_maintenance()
+        except sqlite3.Error as e:
+            logger.error('Error during database maintenance: %s', e)
 
 
 def initialize_database() -> None:
     """Initialize SQLite database with sensor data table"""
-    connection = sqlite3.connect(DB_PATH)
-    cursor = connection.cursor()
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS sensor_data (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            node_id TEXT NOT NULL,
-            timestamp TEXT NOT NULL,
-            temperature_celsius REAL,
-            humidity_percent REAL,
-            distance_cm INTEGER,
-            luminosity_lux INTEGER,
-            presence_detected BOOLEAN,
-            battery_percent INTEGER,
-            rssi_dbm REAL,
-            snr_db REAL,
-            gateway_id INTEGER
-        )
-    ''')
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS gateway_stats (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            gateway_id INTEGER NOT NULL,
-            timestamp TEXT NOT NULL,
-            uptime_seconds INTEGER,
-            rx_total INTEGER,
-            rx_valid INTEGER,
-            rx_invalid INTEGER,
-            rx_checksum_error INTEGER,
-            packet_loss_percent REAL,
-            tx_total INTEGER,
-            tx_success INTEGER,
-            tx_failed INTEGER,
-            server_success_rate REAL,
-            latency_avg_ms REAL,
-            latency_min_ms INTEGER,
-            latency_max_ms INTEGER,
-            latency_last_ms INTEGER,
-            energy_mah REAL,
-            wifi_rssi INTEGER
-        )
-    ''')
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS alerts (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            timestamp TEXT NOT NULL,
-            node_id TEXT,
-            alert_type TEXT NOT NULL,
-            message TEXT NOT NULL,
-            acknowledged BOOLEAN DEFAULT FALSE
-        )
-    ''')
-    connection.commit()
-    connection.close()
+    with closing(sqlite3.connect(DB_PATH)) as connection:
+        # Bancos em memória não suportam WAL
+        if str(DB_PATH) != ':memory:':
+            journal_mode = connection.execute('PRAGMA journal_mode=WAL').fetchone()[0]
+            if journal_mode != 'wal':
+                logger.warning('Could not enable WAL, journal_mode is %s', journal_mode)
+        with connection:
+            connection.executescript(SCHEMA_SQL)
+        # Estatísticas para o planejador escolher os índices acima;
+        # analysis_limit mantém o ANALYZE rápido mesmo em bancos grandes
+        connection.execute('PRAGMA analysis_limit=400')
+        connection.execute('ANALYZE')
     print(f"✓ Database '{DB_NAME}' initialized.")
 
 
-def save_sensor_data(data: Dict[str, Any]) -> None:
-    """Save sensor data to database"""
-    connection = sqlite3.connect(DB_PATH)
-    cursor = connection.cursor()
-    
-    node_id = data.get('node_id', 'unknown')
+def mark_server_start(now: datetime = None) -> None:
+    """Record the server start instant that ESP millisecond timestamps are relative to"""
+    global server_start_time, server_start_epoch_us
+    server_start_time = now or datetime.utcnow()
+    server_start_epoch_us = _epoch_us(server_start_time)
+
+
+def _epoch_us(moment: datetime) -> int:
+    """Microseconds since the epoch for a naive UTC datetime"""
+    return int(moment.replace(tzinfo=timezone.utc).timestamp() * 1_000_000)
+
+
+_ONE_MICROSECOND = timedelta(microseconds=1)
+
+
+def _is_esp_timestamp(value: Any) -> bool:
+    """True for an ESP timestamp (milliseconds since the gateway connected)"""
+    return bool(value) and isinstance(value, (int, float))
+
+
+def _sensor_timestamp(data: Dict[str, Any], now_iso: str = None, epoch_us: int = None) -> str:
+    """Resolve the absolute ISO timestamp for a sensor payload
     
+    ESP millisecond offsets are added to `epoch_us` (default: the server start).
+    """
     # Converter timestamp da ESP (milissegundos desde conexão) para timestamp absoluto
     esp_timestamp_ms = data.get('timestamp')
-    if esp_timestamp_ms and isinstance(esp_timestamp_ms, (int, float)):
-        # Somar os milissegundos da ESP ao tempo de início do servidor
-        absolute_time = server_start_time + timedelta(milliseconds=esp_timestamp_ms)
-        timestamp = absolute_time.isoformat()
-    else:
-        # Fallback para timestamp atual se não houver timestamp da ESP
-        timestamp = datetime.utcnow().isoformat()
-    
+    if _is_esp_timestamp(esp_timestamp_ms):
+        if epoch_us is None:
+            epoch_us = server_start_epoch_us
+        # Aritmética inteira em microssegundos, sem construir um timedelta por linha
+        if isinstance(esp_timestamp_ms, int):
+            offset_us = esp_timestamp_ms * 1000
+        else:
+            # ms fracionário: timedelta arredonda para o µs exatamente; ms * 1000 em float não
+            offset_us = timedelta(milliseconds=esp_timestamp_ms) // _ONE_MICROSECOND
+        absolute_us = epoch_us + offset_us
+        return datetime.utcfromtimestamp(absolute_us / 1_000_000).isoformat()
+    # Fallback para timestamp atual (o do lote, quando fornecido) se não houver timestamp da ESP
+    return now_iso or datetime.utcnow().isoformat()
+
+
+def check_row(row: Tuple[Any, ...], columns: Tuple[str, ...], not_null: Tuple[int, ...] = (0, 1)) -> None:
+    """Raise BadRequest if SQLite could not store `row` (checked before it is queued)"""
+    for index, value in enumerate(row):
+        if value is None:
+            if index in not_null:
+                raise BadRequest(f'Missing required field {columns[index]!r}')
+        elif isinstance(value, int):
+            # SQLite guarda inteiros em 64 bits; valores maiores dão OverflowError no bind
+            if not SQLITE_INT_MIN <= value <= SQLITE_INT_MAX:
+                raise BadRequest(f'Integer out of range for {columns[index]!r}: {value}')
+        elif not isinstance(value, (float, str)):
+            raise BadRequest(f'Unsupported value for {columns[index]!r}: {value!r}')
+
+
+def _build_sensor_row(data: Dict[str, Any], now_iso: str = None, epoch_us: int = None) -> Tuple[Any, ...]:
+    """Flatten a sensor payload into the sensor_data column order"""
     sensors = data.get('sensors', data)
     radio = data.get('radio', {})
-    
-    cursor.execute('''
-        INSERT INTO sensor_data (
-            node_id, timestamp, temperature_celsius, humidity_percent, distance_cm,
-            luminosity_lux, presence_detected, battery_percent, rssi_dbm, snr_db, gateway_id
-        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-    ''', (
-        node_id,
-        timestamp,
+    return (
+        data.get('node_id', 'unknown'),
+        _sensor_timestamp(data, now_iso, epoch_us),
         sensors.get('temperature_celsius', sensors.get('temperature')),
         sensors.get('humidity_percent', sensors.get('humidity')),
         sensors.get('distance_cm'),
@@ -117,35 +496,142 @@ def save_sensor_data(data: Dict[str, Any]) -> None:
         radio.get('rssi_dbm', sensors.get('rssi_dbm')),
         radio.get('snr_db', sensors.get('snr_db')),
         data.get('gateway_id')
-    ))
-    connection.commit()
+    )
+
+
+def collect_alerts(data: Dict[str, Any], timestamp: str = None) -> List[Tuple[Any, ...]]:
+    """Return the alert rows (INSERT_ALERT_SQL order) triggered by a sensor payload"""
+    if timestamp is None:
+        timestamp = datetime.utcnow().isoformat()
+    node_id = data.get('node_id', 'unknown')
+    sensors = data.get('sensors', data)
+    battery = data.get('battery_percent', 100)
+    rows: List[Tuple[Any, ...]] = []
+    
+    if sensors.get('presence_detected'):
+        rows.append((timestamp, node_id, 'presence', f'Presence detected by {node_id}'))
+    
+    if battery is not None and battery < 20:
+        rows.append((timestamp, node_id, 'low_battery', f'Low battery ({battery}%) on {node_id}'))
+    
+    humidity = sensors.get('humidity_percent')
+    if humidity is not None and humidity > 80:
+        rows.append((timestamp, node_id, 'high_humidity', f'High humidity ({humidity:.1f}%) on {node_id}'))
     
-    check_and_generate_alerts(data, connection)
+    return rows
+
+
+def save_sensor_data(data: Dict[str, Any]) -> None:
+    """Save sensor data and its alerts to database in one transaction"""
+    save_sensor_data_many([data])
+
+
+def _build_sensor_batch(items: List[Dict[str, Any]]) -> Tuple[List[Tuple[Any, ...]], List[Tuple[Any, ...]]]:
+    """Flatten sensor payloads into sensor_data rows and the alert rows they trigger"""
+    timestamp = datetime.utcnow().isoformat()
+    sensor_rows = [_build_sensor_row(item, timestamp) for item in items]
+    alert_rows: List[Tuple[Any, ...]] = []
+    for item in items:
+        alert_rows.extend(collect_alerts(item, timestamp))
+    return sensor_rows, alert_rows
+
+
+def _write_sensor_rows(sensor_rows: List[Tuple[Any, ...]], alert_rows: List[Tuple[Any, ...]]) -> None:
+    """Insert pre-built sensor and alert rows in a single transaction"""
+    with get_write_connection() as connection:
+        for start in range(0, len(sensor_rows), SENSOR_BATCH_CHUNK):
+            connection.executemany(INSERT_SENSOR_SQL, sensor_rows[start:start + SENSOR_BATCH_CHUNK])
+        for start in range(0, len(alert_rows), SENSOR_BATCH_CHUNK):
+            connection.executemany(INSERT_ALERT_SQL, alert_rows[start:start + SENSOR_BATCH_CHUNK])
+    _invalidate_sensor_caches()
+
+
+def save_sensor_data_many(items: List[Dict[str, Any]]) -> None:
+    """Save a batch of sensor payloads in a single transaction"""
+    _write_sensor_rows(*_build_sensor_batch(items))
+
+
+def enqueue_sensor_data(items: List[Dict[str, Any]]) -> None:
+    """Queue sensor payloads for the background writer
     
-    connection.close()
+    Rows are built and checked here so malformed payloads fail their own request
+    (BadRequest). If the queue is full the rows are written synchronously,
+    applying back-pressure.
+    """
+    rows = _build_sensor_batch(items)
+    for row in rows[0]:
+        check_row(row, SENSOR_COLUMNS)
+    try:
+        sensor_write_queue.put_nowait(rows)
+    except queue.Full:
+        _write_sensor_rows(*rows)
 
 
-def save_gateway_stats(data: Dict[str, Any]) -> None:
-    """Save gateway statistics to database"""
-    connection = sqlite3.connect(DB_PATH)
-    cursor = connection.cursor()
+def _drain_sensor_queue(first: Any = None) -> None:
+    """Write up to SENSOR_WRITER_BATCH queued entries in one transaction"""
+    batch = [] if first is None else [first]
+    while len(batch) < SENSOR_WRITER_BATCH:
+        try:
+            batch.append(sensor_write_queue.get_nowait())
+        except queue.Empty:
+            break
+    if not batch:
+        return
+    sensor_rows: List[Tuple[Any, ...]] = []
+    alert_rows: List[Tuple[Any, ...]] = []
+    for entry_sensor_rows, entry_alert_rows in batch:
+        sensor_rows.extend(entry_sensor_rows)
+        alert_rows.extend(entry_alert_rows)
+    try:
+        _write_sensor_rows(sensor_rows, alert_rows)
+        return
+    except Exception as e:
+        if len(batch) == 1:
+            logger.error('Dropping queued sensor entry (%d rows): %s', len(sensor_rows), e)
+            return
+        logger.warning('Sensor batch of %d entries failed (%s); retrying one by one', len(batch), e)
     
-    gateway_id = data.get('gateway_id', 0)
+    # A transação do lote foi desfeita: regravar cada entrada isolada,
+    # para que uma entrada ruim não derrube as das outras requisições
+    for entry_sensor_rows, entry_alert_rows in batch:
+        try:
+            _write_sensor_rows(entry_sensor_rows, entry_alert_rows)
+        except Exception as e:
+            logger.error('Dropping queued sensor entry (%d rows): %s', len(entry_sensor_rows), e)
+
+
+def _sensor_writer() -> None:
+    """Background loop draining the sensor write queue"""
+    while True:
+        first = sensor_write_queue.get()
+        try:
+            _drain_sensor_queue(first)
+        except Exception:
+            # Nunca deixar a thread morrer: o POST já respondeu "stored"
+            logger.exception('Error writing sensor batch')
+
+
+def flush_sensor_queue() -> None:
+    """Synchronously write everything still waiting in the sensor queue"""
+    while not sensor_write_queue.empty():
+        _drain_sensor_queue()
+
+
+def start_background_writers() -> None:
+    """Start the sensor writer, gateway stats flusher and maintenance threads"""
+    threading.Thread(target=_sensor_writer, daemon=True).start()
+    threading.Thread(target=_gateway_stats_flusher, daemon=True).start()
+    threading.Thread(target=_maintenance_loop, daemon=True).start()
+
+
+def _build_gateway_row(data: Dict[str, Any]) -> Tuple[Any, ...]:
+    """Flatten a gateway stats payload into the gateway_stats column order"""
     lora = data.get('lora_stats', {})
     server = data.get('server_stats', {})
     latency = data.get('latency', {})
-    
-    cursor.execute('''
-        INSERT INTO gateway_stats (
-            gateway_id, timestamp, uptime_seconds,
-            rx_total, rx_valid, rx_invalid, rx_checksum_error, packet_loss_percent,
-            tx_total, tx_success, tx_failed, server_success_rate,
-            latency_avg_ms, latency_min_ms, latency_max_ms, latency_last_ms,
-            energy_mah, wifi_rssi
-        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-    ''', (
-        gateway_id,
-        data.get('timestamp', datetime.utcnow().isoformat()),
+    return (
+        data.get('gateway_id', 0),
+        data['timestamp'] if 'timestamp' in data else datetime.utcnow().isoformat(),
         data.get('uptime_seconds', 0),
         lora.get('rx_total', 0),
         lora.get('rx_valid', 0),
@@ -162,429 +648,686 @@ def save_gateway_stats(data: Dict[str, Any]) -> None:
         latency.get('last_ms', 0),
         data.get('energy_mah', 0),
         data.get('wifi_rssi')
-    ))
-    connection.commit()
-    connection.close()
-    
-    gateway_stats_cache[gateway_id] = data
+    )
 
 
-def check_and_generate_alerts(data: Dict[str, Any], connection: sqlite3.Connection) -> None:
-    """Check sensor data and generate alerts if thresholds are exceeded"""
-    cursor = connection.cursor()
-    node_id = data.get('node_id', 'unknown')
-    sensors = data.get('sensors', data)
-    battery = data.get('battery_percent', 100)
-    timestamp = datetime.utcnow().isoformat()
-    
-    if sensors.get('presence_detected'):
-        cursor.execute('''
-            INSERT INTO alerts (timestamp, node_id, alert_type, message)
-            VALUES (?, ?, ?, ?)
-        ''', (timestamp, node_id, 'presence', f'Presence detected by {node_id}'))
-    
-    if battery is not None and battery < 20:
-        cursor.execute('''
-            INSERT INTO alerts (timestamp, node_id, alert_type, message)
-            VALUES (?, ?, ?, ?)
-        ''', (timestamp, node_id, 'low_battery', f'Low battery ({battery}%) on {node_id}'))
-    
-    humidity = sensors.get('humidity_percent')
-    if humidity is not None and humidity > 80:
-        cursor.execute('''
-            INSERT INTO alerts (timestamp, node_id, alert_type, message)
-            VALUES (?, ?, ?, ?)
-        ''', (timestamp, node_id, 'high_humidity', f'High humidity ({humidity:.1f}%) on {node_id}'))
+def _gateway_payload(row: sqlite3.Row) -> Dict[str, Any]:
+    """Rebuild the nested payload shape (as POSTed by the gateway) from a gateway_stats row"""
+    return {
+        'gateway_id': row['gateway_id'],
+        'timestamp': row['timestamp'],
+        'uptime_seconds': row['uptime_seconds'],
+        'lora_stats': {
+            'rx_total': row['rx_total'],
+            'rx_valid': row['rx_valid'],
+            'rx_invalid': row['rx_invalid'],
+            'rx_checksum_error': row['rx_checksum_error'],
+            'packet_loss_percent': row['packet_loss_percent']
+        },
+        'server_stats': {
+            'tx_total': row['tx_total'],
+            'tx_success': row['tx_success'],
+            'tx_failed': row['tx_failed'],
+            'success_rate_percent': row['server_success_rate']
+        },
+        'latency': {
+            'avg_ms': row['latency_avg_ms'],
+            'min_ms': row['latency_min_ms'],
+            'max_ms': row['latency_max_ms'],
+            'last_ms': row['latency_last_ms']
+        },
+        'energy_mah': row['energy_mah'],
+        'wifi_rssi': row['wifi_rssi']
+    }
+
+
+def save_gateway_stats(data: Dict[str, Any]) -> None:
+    """Buffer gateway statistics; rows reach the database on the next flush"""
+    row = _build_gateway_row(data)
+    check_row(row, GATEWAY_COLUMNS)  # Rejeitar aqui: o buffer é gravado em lote depois
+    _gateway_stats_buffer.append(row)
+    with _gateway_stats_lock:
+        gateway_stats_cache[data.get('gateway_id', 0)] = data
+    gateway_stats_history_json.cache_clear()
     
-    connection.commit()
+    if len(_gateway_stats_buffer) >= GATEWAY_FLUSH_ROWS:
+        flush_gateway_stats()
+
+
+def flush_gateway_stats() -> None:
+    """Write all buffered gateway statistics in a single transaction"""
+    rows: List[Tuple[Any, ...]] = []
+    while True:
+        try:
+            rows.append(_gateway_stats_buffer.popleft())
+        except IndexError:
+            break
+    if not rows:
+        return
+    try:
+        with get_write_connection() as connection:
+            connection.executemany(INSERT_GATEWAY_SQL, rows)
+    except Exception as e:
+        logger.warning('Gateway stats flush of %d rows failed (%s); retrying one by one', len(rows), e)
+        _write_gateway_rows_individually(rows)
+    gateway_stats_history_json.cache_clear()
+
+
+def _write_gateway_rows_individually(rows: List[Tuple[Any, ...]]) -> None:
+    """Write rows one per transaction, dropping bad rows and re-buffering transient failures"""
+    retry: List[Tuple[Any, ...]] = []
+    for row in rows:
+        try:
+            with get_write_connection() as connection:
+                connection.execute(INSERT_GATEWAY_SQL, row)
+        except sqlite3.OperationalError as e:
+            # Banco bloqueado/indisponível: a linha volta para o próximo flush
+            logger.error('Gateway stats row kept for the next flush: %s', e)
+            retry.append(row)
+        except Exception as e:
+            logger.error('Dropping gateway stats row for gateway %s: %s', row[0], e)
+    _gateway_stats_buffer.extendleft(reversed(retry))
+
+
+def load_gateway_stats_cache() -> None:
+    """Seed gateway_stats_cache with the latest stored row of each gateway (payload shape)"""
+    with get_connection() as connection:
+        cursor = connection.cursor()
+        cursor.row_factory = sqlite3.Row
+        rows = cursor.execute(SELECT_GW_LATEST_SQL).fetchall()
+    with _gateway_stats_lock:
+        for row in rows:
+            # Estatísticas recebidas antes do carregamento têm prioridade
+            gateway_stats_cache.setdefault(row['gateway_id'], _gateway_payload(row))
+
+
+def get_cached_gateway_stats() -> List[Dict[str, Any]]:
+    """Return a snapshot of the latest stats of every known gateway"""
+    with _gateway_stats_lock:
+        return list(gateway_stats_cache.values())
+
+
+def _gateway_stats_flusher() -> None:
+    """Background loop flushing the gateway stats buffer periodically"""
+    while not _gateway_flush_stop.wait(GATEWAY_FLUSH_INTERVAL_S):
+        try:
+            flush_gateway_stats()
+        except Exception:
+            logger.exception('Error flushing gateway stats')
 
 
 def fetch_recent_data(limit: int = 100) -> List[Dict[str, Any]]:
     """Fetch recent sensor data from database"""
-    connection = sqlite3.connect(DB_PATH)
-    cursor = connection.cursor()
-    cursor.execute('''
-        SELECT 
-            node_id, timestamp, temperature_celsius, humidity_percent, distance_cm,
-            luminosity_lux, presence_detected, battery_percent, rssi_dbm, snr_db, gateway_id
-        FROM sensor_data 
-        ORDER BY timestamp DESC 
-        LIMIT ?
-    ''', (limit,))
-    rows = cursor.fetchall()
-    connection.close()
-
-    data_rows: List[Dict[str, Any]] = []
-    for row in rows:
-        data_rows.append({
-            'node_id': row[0],
-            'timestamp': row[1],
-            'sensors': {
-                'temperature_celsius': row[2],
-                'humidity_percent': row[3],
-                'distance_cm': row[4],
-                'luminosity_lux': row[5],
-                'presence_detected': bool(row[6]),
-                'rssi_dbm': row[8],
-                'snr_db': row[9]
-            },
-            'battery_percent': row[7],
-            'gateway_id': row[10]
-        })
-    return data_rows
+    with get_connection() as connection:
+        cursor = connection.cursor()
+        cursor.row_factory = sqlite3.Row
+        cursor.execute(SELECT_RECENT_SQL, (limit,))
+        rows = cursor.fetchall()
+
+    return [{
+        'node_id': row['node_id'],
+        'timestamp': row['timestamp'],
+        'sensors': {
+            'temperature_celsius': row['temperature_celsius'],
+            'humidity_percent': row['humidity_percent'],
+            'distance_cm': row['distance_cm'],
+            'luminosity_lux': row['luminosity_lux'],
+            'presence_detected': bool(row['presence_detected']),
+            'rssi_dbm': row['rssi_dbm'],
+            'snr_db': row['snr_db']
+        },
+        'battery_percent': row['battery_percent'],
+        'gateway_id': row['gateway_id']
+    } for row in rows]
 
 
 def fetch_alerts(limit: int = 50, unacknowledged_only: bool = False) -> List[Dict[str, Any]]:
     """Fetch recent alerts from database"""
-    connection = sqlite3.connect(DB_PATH)
-    cursor = connection.cursor()
-    
-    query = '''
-        SELECT id, timestamp, node_id, alert_type, message, acknowledged
-        FROM alerts
-    '''
-    if unacknowledged_only:
-        query += ' WHERE acknowledged = FALSE'
-    query += ' ORDER BY timestamp DESC LIMIT ?'
+    with get_connection() as connection:
+        cursor = connection.cursor()
+        cursor.row_factory = sqlite3.Row
+        query = SELECT_ALERTS_UNACK_SQL if unacknowledged_only else SELECT_ALERTS_SQL
+        cursor.execute(query, (limit,))
+        rows = cursor.fetchall()
     
-    cursor.execute(query, (limit,))
-    rows = cursor.fetchall()
-    connection.close()
-    
-    return [{
-        'id': row[0],
-        'timestamp': row[1],
-        'node_id': row[2],
-        'alert_type': row[3],
-        'message': row[4],
-        'acknowledged': bool(row[5])
-    } for row in rows]
+    alerts = [dict(row) for row in rows]
+    for alert in alerts:
+        alert['acknowledged'] = bool(alert['acknowledged'])
+    return alerts
+
 
+def history_bucket_seconds(hours: int) -> int:
+    """Default bucket width keeping a window near HISTORY_MAX_POINTS points"""
+    return max(HISTORY_MIN_BUCKET_S, -(-hours * 3600 // HISTORY_MAX_POINTS))
 
-def fetch_historical_data(hours: int = 24) -> Dict[str, Any]:
-    """Fetch historical sensor data for charts"""
-    connection = sqlite3.connect(DB_PATH)
-    cursor = connection.cursor()
+
+def fetch_historical_data(hours: int = 24, bucket_seconds: int = None) -> Dict[str, Any]:
+    """Fetch historical sensor data for charts, averaged per time bucket
     
+    `bucket_seconds=0` returns the raw samples.
+    """
     since = (datetime.utcnow() - timedelta(hours=hours)).isoformat()
+    if bucket_seconds is None:
+        bucket_seconds = history_bucket_seconds(hours)
     
-    cursor.execute('''
-        SELECT timestamp, humidity_percent, distance_cm, battery_percent
-        FROM sensor_data
-        WHERE timestamp >= ?
-        ORDER BY timestamp ASC
-    ''', (since,))
-    rows = cursor.fetchall()
-    connection.close()
+    with get_connection() as connection:
+        cursor = connection.cursor()
+        if bucket_seconds > 0:
+            cursor.execute(SELECT_HISTORY_BUCKETED_SQL, (bucket_seconds, bucket_seconds, since))
+        else:
+            cursor.execute(SELECT_HISTORY_SQL, (since,))
+        rows = cursor.fetchall()
     
+    # Transpõe as linhas em colunas numa única passada (zip em C)
+    timestamps, humidity, distance, battery = map(list, zip(*rows)) if rows else ([], [], [], [])
     return {
-        'timestamps': [row[0] for row in rows],
-        'humidity': [row[1] for row in rows],
-        'distance': [row[2] for row in rows],
-        'battery': [row[3] for row in rows]
+        'timestamps': timestamps,
+        'humidity': humidity,
+        'distance': distance,
+        'battery': battery
     }
 
 
 def fetch_gateway_stats_history(gateway_id: int = 1, limit: int = 100) -> List[Dict[str, Any]]:
-    """Fetch gateway statistics history"""
-    connection = sqlite3.connect(DB_PATH)
-    cursor = connection.cursor()
-    
-    cursor.execute('''
-        SELECT timestamp, uptime_seconds, rx_total, rx_valid, rx_invalid,
-               packet_loss_percent, latency_avg_ms, energy_mah
-        FROM gateway_stats
-        WHERE gateway_id = ?
-        ORDER BY timestamp DESC
-        LIMIT ?
-    ''', (gateway_id, limit))
-    rows = cursor.fetchall()
-    connection.close()
+    """Fetch gateway statistics history (flushing buffered rows first)"""
+    flush_gateway_stats()
+    with get_connection() as connection:
+        cursor = connection.cursor()
+        cursor.row_factory = sqlite3.Row
+        cursor.execute(SELECT_GW_HISTORY_SQL, (gateway_id, limit))
+        rows = cursor.fetchall()
     
-    return [{
-        'timestamp': row[0],
-        'uptime_seconds': row[1],
-        'rx_total': row[2],
-        'rx_valid': row[3],
-        'rx_invalid': row[4],
-        'packet_loss_percent': row[5],
-        'latency_avg_ms': row[6],
-        'energy_mah': row[7]
-    } for row in rows]
+    # As colunas do SELECT já têm os nomes usados na resposta
+    return [dict(row) for row in rows]
 
 
 def fetch_active_nodes_count() -> int:
     """Count unique node IDs in the database"""
-    connection = sqlite3.connect(DB_PATH)
-    cursor = connection.cursor()
-    cursor.execute('SELECT COUNT(DISTINCT node_id) FROM sensor_data')
-    count = cursor.fetchone()[0]
-    connection.close()
+    with get_connection() as connection:
+        cursor = connection.cursor()
+        cursor.execute(COUNT_ACTIVE_NODES_SQL)
+        count = cursor.fetchone()[0]
     return count
 
 
+def acknowledge_alert(alert_id: Any) -> None:
+    """Mark an alert as acknowledged"""
+    acknowledge_alerts([alert_id])
+
+
+def acknowledge_alerts(alert_ids: Iterable[Any]) -> None:
+    """Mark several alerts as acknowledged in a single transaction"""
+    rows = [(alert_id,) for alert_id in alert_ids]
+    if not rows:
+        return
+    with get_write_connection() as connection:
+        connection.executemany(ACKNOWLEDGE_ALERT_SQL, rows)
+    alerts_json.cache_clear()
+
+
+def ttl_cache(seconds: float) -> Callable[[Callable[..., Any]], Callable[..., Any]]:
+    """Cache results per positional arguments for `seconds`; adds cache_clear()
+    
+    cache_clear() bumps a generation counter so a read that started before a
+    write cannot store its (stale) result after the invalidation: the counter
+    is re-checked under the same lock that cache_clear() takes.
+    """
+    def decorator(fn: Callable[..., Any]) -> Callable[..., Any]:
+        cache: Dict[Tuple[Any, ...], Tuple[float, Any]] = {}
+        generation = [0]
+        lock = threading.Lock()
+        
+        @functools.wraps(fn)
+        def wrapper(*args: Any) -> Any:
+            now = time.monotonic()
+            entry = cache.get(args)
+            if entry is not None and entry[0] > now:
+                return entry[1]
+            with lock:
+                started_generation = generation[0]
+            value = fn(*args)
+            with lock:
+                # Um cache_clear() durante fn() invalida este resultado
+                if generation[0] == started_generation:
+                    if len(cache) >= TTL_CACHE_MAX_ENTRIES:
+                        cache.clear()
+                    cache[args] = (now + seconds, value)
+            return value
+        
+        def cache_clear() -> None:
+            with lock:
+                generation[0] += 1
+                cache.clear()
+        
+        wrapper.cache_clear = cache_clear
+        return wrapper
+    return decorator
+
+
+# Respostas JSON já serializadas para os endpoints consultados pelo dashboard;
+# invalidadas pelas gravações correspondentes
+
+@ttl_cache(2)
+def recent_data_json(limit: int = 100) -> bytes:
+    try:
+        with get_connection() as connection:
+            rows = connection.execute(SELECT_RECENT_JSON_SQL, (limit,)).fetchall()
+    except sqlite3.OperationalError:
+        # SQLite compilado sem JSON1: montar os dicts em Python
+        return dumps_json(fetch_recent_data(limit))
+    return ('[' + ','.join(row[0] for row in rows) + ']').encode('utf-8')
+
+
+@ttl_cache(2)
+def alerts_json(limit: int = 50, unacknowledged_only: bool = False) -> bytes:
+    return dumps_json(fetch_alerts(limit, unacknowledged_only))
+
+
+@ttl_cache(5)
+def historical_data_json(hours: int = 24, bucket_seconds: int = None) -> bytes:
+    return dumps_json(fetch_historical_data(hours, bucket_seconds))
+
+
+@ttl_cache(5)
+def gateway_stats_history_json(gateway_id: int = 1, limit: int = 100) -> bytes:
+    return dumps_json(fetch_gateway_stats_history(gateway_id, limit))
+
+
+@ttl_cache(5)
+def active_nodes_json() -> bytes:
+    return dumps_json({'active_nodes': fetch_active_nodes_count()})
+
+
+def _invalidate_sensor_caches() -> None:
+    """Drop cached responses that depend on sensor_data or alerts"""
+    recent_data_json.cache_clear()
+    alerts_json.cache_clear()
+    historical_data_json.cache_clear()
+    active_nodes_json.cache_clear()
+
+
+# Campos de texto que não devem virar números ao normalizar células de CSV
+IMPORT_TEXT_FIELDS = frozenset({'node_id', 'timestamp'})
+
+
+def _parse_import_cell(value: str) -> Any:
+    """Convert a CSV cell to the value a JSON payload would carry"""
+    value = value.strip()
+    if not value:
+        return None
+    lowered = value.lower()
+    if lowered in ('true', 'false'):
+        return 1 if lowered == 'true' else 0
+    for convert in (int, float):
+        try:
+            return convert(value)
+        except ValueError:
+            pass
+    return value
+
+
+def _normalize_import_item(item: Dict[str, Any]) -> Dict[str, Any]:
+    """Give string cells (e.g. csv.DictReader rows) their JSON types; typed values pass through"""
+    normalized: Dict[str, Any] = {}
+    for key, value in item.items():
+        if isinstance(value, dict):
+            value = _normalize_import_item(value)
+        elif isinstance(value, str):
+            if key in IMPORT_TEXT_FIELDS:
+                value = value.strip() or None
+                # Um offset da ESP lido como texto ('12345') continua sendo um offset
+                if key == 'timestamp' and value is not None:
+                    parsed = _parse_import_cell(value)
+                    if isinstance(parsed, (int, float)):
+                        value = parsed
+            else:
+                value = _parse_import_cell(value)
+        normalized[key] = value
+    return normalized
+
+
+def bulk_import(items: Iterable[Dict[str, Any]], chunk: int = 10000, base_time: datetime = None) -> int:
+    """Bulk-load recorded sensor payloads (e.g. a telemetry dump) into sensor_data
+    
+    Meant for offline imports into the dev database, with the server stopped:
+    durability is relaxed and idx_sensor_ts is dropped while loading, then
+    rebuilt once at the end. Items are JSON-style payloads; string cells (such
+    as csv.DictReader rows) are normalized first: empty means missing,
+    numbers are parsed and 'true'/'false' become 1/0. Accepted `timestamp`
+    values:
+    
+    - ISO 8601 strings (anything datetime.fromisoformat accepts), kept as
+      recorded; other strings raise ValueError;
+    - numeric ESP offsets (milliseconds since the gateway connected), added to
+      `base_time` (naive UTC, the start of the capture); a ValueError is raised
+      if such a row appears without `base_time`;
+    - missing, null or 0, stored as the import time.
+    
+    Returns the number of rows imported.
+    """
+    imported = 0
+    base_us = None if base_time is None else _epoch_us(base_time)
+    now_iso = datetime.utcnow().isoformat()
+    with closing(sqlite3.connect(DB_PATH, isolation_level=None)) as connection:
+        connection.execute('PRAGMA synchronous=OFF')
+        connection.execute('PRAGMA journal_mode=MEMORY')
+        connection.execute('DROP INDEX IF EXISTS idx_sensor_ts')
+        try:
+            connection.execute('BEGIN')
+            iterator = iter(items)
+            while True:
+                batch = list(islice(iterator, chunk))
+                if not batch:
+                    break
+                rows = []
+                for item in batch:
+                    item = _normalize_import_item(item)
+                    timestamp = item.get('timestamp')
+                    if isinstance(timestamp, str):
+                        try:
+                            datetime.fromisoformat(timestamp)
+                        except ValueError:
+                            raise ValueError(f"Row {imported + len(rows)} has an unparseable "
+                                             f"timestamp {timestamp!r}") from None
+                    elif base_us is None and _is_esp_timestamp(timestamp):
+                        raise ValueError(f"Row {imported + len(rows)} has a numeric ESP timestamp "
+                                         f"({timestamp!r} ms); pass base_time to resolve it")
+                    row = _build_sensor_row(item, now_iso, base_us)
+                    if isinstance(timestamp, str):
+                        row = (row[0], timestamp) + row[2:]
+                    rows.append(row)
+                connection.executemany(INSERT_SENSOR_SQL, rows)
+                imported += len(rows)
+            connection.execute('COMMIT')
+        except BaseException:
+            # BEGIN pode ter falhado, ou o SQLite já desfez a transação (SQLITE_FULL/IOERR)
+            if connection.in_transaction:
+                connection.execute('ROLLBACK')
+            raise
+        finally:
+            # Recria o índice removido e restaura o modo normal de operação
+            connection.executescript(SCHEMA_SQL)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+    return imported
+
+
 class SensorServerHandler(http.server.SimpleHTTPRequestHandler):
     """HTTP request handler for sensor data"""
     
-    def do_POST(self) -> None:
-        """Handle POST requests for sensor data"""
-        if self.path in ['/data', '/api/sensor-data']:
-            try:
-                content_length = int(self.headers.get('Content-Length', 0))
-                request_body = self.rfile.read(content_length)
-                
-                print(f"\n[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] POST received from {self.client_address[0]}")
-                
-                payload = json.loads(request_body)
-                
-                if isinstance(payload, list):
-                    print(f"  [BATCH] Received {len(payload)} messages")
-                    for item in payload:
-                        save_sensor_data(item)
-                        print(f"    - Node: {item.get('node_id', 'unknown')}")
-                    saved_count = len(payload)
-                else:
-                    sensors = payload.get('sensors', payload)
-                    print(f"  Node: {payload.get('node_id', 'unknown')}")
-                    if 'humidity_percent' in sensors:
-                        print(f"  Humidity: {sensors.get('humidity_percent')}%")
-                    if 'distance_cm' in sensors:
-                        print(f"  Distance: {sensors.get('distance_cm')} cm")
-                    if 'presence_detected' in sensors:
-                        print(f"  Presence: {'✓ DETECTED' if sensors.get('presence_detected') else 'No'}")
-                    save_sensor_data(payload)
-                    saved_count = 1
-                
-                self.send_response(200, 'OK')
-                self.send_header('Content-type', 'application/json')
-                self.end_headers()
-                response = {'status': 'success', 'message': f'{saved_count} message(s) stored'}
-                self.wfile.write(json.dumps(response).encode())
-                
-            except json.JSONDecodeError as e:
-                print(f"Error: Invalid JSON - {e}")
-                self.send_response(400, 'Bad Request')
-                self.end_headers()
-                self.wfile.write(b'Invalid JSON')
-                
-            except Exception as e:
-                print(f"Error: {e}")
-                import traceback
-                traceback.print_exc()
-                self.send_response(500, 'Internal Server Error')
-                self.end_headers()
-                self.wfile.write(f'Server error: {e}'.encode())
-                
-        elif self.path == '/api/gateway-stats':
-            try:
-                content_length = int(self.headers.get('Content-Length', 0))
-                request_body = self.rfile.read(content_length)
-                payload = json.loads(request_body)
-                
-                print(f"\n[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] Gateway Stats received")
-                print(f"  Gateway ID: {payload.get('gateway_id')}")
-                print(f"  Uptime: {payload.get('uptime_seconds', 0)}s")
-                
-                lora = payload.get('lora_stats', {})
-                print(f"  RX: {lora.get('rx_valid', 0)}/{lora.get('rx_total', 0)} valid")
-                print(f"  Packet Loss: {lora.get('packet_loss_percent', 0):.1f}%")
-                
-                latency = payload.get('latency', {})
-                print(f"  Latency: avg={latency.get('avg_ms', 0):.1f}ms, last={latency.get('last_ms', 0)}ms")
-                
-                save_gateway_stats(payload)
-                
-                self.send_response(200, 'OK')
-                self.send_header('Content-type', 'application/json')
-                self.end_headers()
-                response = {'status': 'success', 'message': 'Stats received'}
-                self.wfile.write(json.dumps(response).encode())
-                
-            except Exception as e:
-                print(f"Error saving gateway stats: {e}")
-                self.send_response(500, 'Internal Server Error')
-                self.end_headers()
-                self.wfile.write(f'Server error: {e}'.encode())
-                
-        elif self.path == '/api/alerts/acknowledge':
-            try:
-                content_length = int(self.headers.get('Content-Length', 0))
-                request_body = self.rfile.read(content_length)
-                payload = json.loads(request_body)
-                alert_id = payload.get('id')
-                
-                if alert_id:
-                    connection = sqlite3.connect(DB_PATH)
-                    cursor = connection.cursor()
-                    cursor.execute('UPDATE alerts SET acknowledged = TRUE WHERE id = ?', (alert_id,))
-                    connection.commit()
-                    connection.close()
-                
-                self.send_response(200, 'OK')
-                self.send_header('Content-type', 'application/json')
-                self.end_headers()
-                self.wfile.write(json.dumps({'status': 'success'}).encode())
-                
-            except Exception as e:
-                self.send_response(500, 'Internal Server Error')
-                self.end_headers()
-                self.wfile.write(f'Server error: {e}'.encode())
-        else:
-            self.send_response(404, 'Not Found')
-            self.end_headers()
-
-    def do_GET(self) -> None:
-        """Handle GET requests"""
-        print(f"[{datetime.now().strftime('%H:%M:%S')}] GET {self.path} from {self.client_address[0]}")
-        
-        if self.path == '/':
-            self.path = '/dashboard.html'
-            return http.server.SimpleHTTPRequestHandler.do_GET(self)
+    # Keep-alive: gateways reutilizam a conexão TCP entre POSTs (toda resposta leva Content-Length)
+    protocol_version = 'HTTP/1.1'
+    # Conexões ociosas são encerradas após este tempo, liberando a thread
+    timeout = 30
+    
+    def _send_json(self, status: int, obj: Any) -> None:
+        """Send a JSON response with Content-Length and CORS headers
         
-        elif self.path == '/data':
-            try:
-                recent_data = fetch_recent_data()
-                
-                self.send_response(200)
-                self.send_header('Content-type', 'application/json')
-                self.send_header('Access-Control-Allow-Origin', '*')
-                self.end_headers()
-                self.wfile.write(json.dumps(recent_data).encode())
-            except Exception as e:
-                print(f"Error: {e}")
-                self.send_response(500, 'Internal Server Error')
-                self.end_headers()
-                self.wfile.write(f'Server error: {e}'.encode())
+        `obj` may already be serialized JSON bytes (cached responses).
+        """
+        self.send_response(status)
+        self.send_header('Content-type', 'application/json')
+        self.send_header('Access-Control-Allow-Origin', '*')
+        self._send_bytes(obj if isinstance(obj, bytes) else dumps_json(obj))
+    
+    def _send_bytes(self, data: bytes) -> None:
+        """Finish the headers with Content-Length and write the body in slices"""
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        # memoryview: fatias sem cópia, escritas em blocos de RESPONSE_CHUNK_SIZE
+        view = memoryview(data)
+        for start in range(0, len(view), RESPONSE_CHUNK_SIZE):
+            self.wfile.write(view[start:start + RESPONSE_CHUNK_SIZE])
+    
+    def _send_error_body(self, status: int, message: str, body: bytes) -> None:
+        """Send a plain error response and close the connection
         
-        elif self.path == '/api/alerts':
-            try:
-                alerts = fetch_alerts(50, False)
-                self.send_response(200)
-                self.send_header('Content-type', 'application/json')
-                self.send_header('Access-Control-Allow-Origin', '*')
-                self.end_headers()
-                self.wfile.write(json.dumps(alerts).encode())
-            except Exception as e:
-                self.send_response(500, 'Internal Server Error')
-                self.end_headers()
-                self.wfile.write(f'Server error: {e}'.encode())
+        The request body may be unread (404, 413), so the stream cannot be reused.
+        """
+        self.send_response(status, message)
+        self.send_header('Connection', 'close')
+        self._send_bytes(body)
+    
+    def _wrap_json(self, handler: Callable[..., Any], arg: Any) -> None:
+        """Run a route handler and send its result as JSON, mapping failures to 500"""
+        try:
+            result = handler(self, arg)
+        except BadRequest as e:
+            self._send_error_body(400, 'Bad Request', str(e).encode())
+            return
+        except Exception as e:
+            logger.exception('Error handling %s %s: %s', self.command, self.path, e)
+            self._send_error_body(500, 'Internal Server Error', f'Server error: {e}'.encode())
+            return
+        self._send_json(200, result)
+    
+    def _read_body(self) -> Optional[bytearray]:
+        """Read the request body into a bytearray, or send 400/413 and return None"""
+        try:
+            content_length = int(self.headers.get('Content-Length', 0))
+        except ValueError:
+            content_length = -1
+        if content_length < 0:
+            self._send_error_body(400, 'Bad Request', b'Invalid Content-Length')
+            return None
+        if content_length > MAX_BODY:
+            # Corpo não é lido; _send_error_body fecha a conexão em vez de drená-lo
+            self._send_error_body(413, 'Payload Too Large', b'Request body too large')
+            return None
         
-        elif self.path == '/api/alerts/unacknowledged':
-            try:
-                alerts = fetch_alerts(50, True)
-                self.send_response(200)
-                self.send_header('Content-type', 'application/json')
-                self.send_header('Access-Control-Allow-Origin', '*')
-                self.end_headers()
-                self.wfile.write(json.dumps(alerts).encode())
-            except Exception as e:
-                self.send_response(500, 'Internal Server Error')
-                self.end_headers()
-                self.wfile.write(f'Server error: {e}'.encode())
+        body = bytearray(content_length)
+        view = memoryview(body)
+        received = 0
+        while received < content_length:
+            n = self.rfile.readinto(view[received:])
+            if not n:
+                self._send_error_body(400, 'Bad Request', b'Incomplete body')
+                return None
+            received += n
+        return body
+    
+    # ---- POST routes (recebem o payload JSON já decodificado) ----
+    
+    def _post_sensor_data(self, payload: Any) -> Dict[str, Any]:
+        if isinstance(payload, list):
+            enqueue_sensor_data(payload)
+            saved_count = len(payload)
+            logger.info('POST %s from %s: batch of %d message(s)', self.path, self.client_address[0], saved_count)
+            if logger.isEnabledFor(logging.DEBUG):
+                for item in payload:
+                    logger.debug('  - Node: %s', item.get('node_id', 'unknown'))
+        else:
+            sensors = payload.get('sensors', payload)
+            enqueue_sensor_data([payload])
+            saved_count = 1
+            logger.debug('POST %s from %s: node %s', self.path, self.client_address[0], payload.get('node_id', 'unknown'))
+            logger.debug('  Humidity: %s%% | Distance: %s cm | Presence: %s',
+                         sensors.get('humidity_percent'), sensors.get('distance_cm'),
+                         sensors.get('presence_detected'))
         
-        elif self.path.startswith('/api/history'):
-            try:
-                hours = 24
-                if '?' in self.path:
-                    params = self.path.split('?')[1]
-                    for param in params.split('&'):
-                        if param.startswith('hours='):
-                            hours = int(param.split('=')[1])
-                
-                history = fetch_historical_data(hours)
-                self.send_response(200)
-                self.send_header('Content-type', 'application/json')
-                self.send_header('Access-Control-Allow-Origin', '*')
-                self.end_headers()
-                self.wfile.write(json.dumps(history).encode())
-            except Exception as e:
-                self.send_response(500, 'Internal Server Error')
-                self.end_headers()
-                self.wfile.write(f'Server error: {e}'.encode())
+        return {'status': 'success', 'message': f'{saved_count} message(s) stored'}
+    
+    def _post_gateway_stats(self, payload: Any) -> Any:
+        logger.info('Gateway stats received from gateway %s', payload.get('gateway_id'))
+        if logger.isEnabledFor(logging.DEBUG):
+            lora = payload.get('lora_stats', {})
+            latency = payload.get('latency', {})
+            logger.debug('  Uptime: %ss | RX: %s/%s valid | Packet Loss: %.1f%% | Latency: avg=%.1fms, last=%sms',
+                         payload.get('uptime_seconds', 0), lora.get('rx_valid', 0), lora.get('rx_total', 0),
+                         lora.get('packet_loss_percent', 0), latency.get('avg_ms', 0), latency.get('last_ms', 0))
         
-        elif self.path == '/api/gateway-stats':
-            try:
-                stats_list = list(gateway_stats_cache.values())
-                if not stats_list:
-                    stats_list = fetch_gateway_stats_history(1, 1)
-                
-                self.send_response(200)
-                self.send_header('Content-type', 'application/json')
-                self.send_header('Access-Control-Allow-Origin', '*')
-                self.end_headers()
-                self.wfile.write(json.dumps(stats_list).encode())
-            except Exception as e:
-                self.send_response(500, 'Internal Server Error')
-                self.end_headers()
-                self.wfile.write(f'Server error: {e}'.encode())
+        save_gateway_stats(payload)
+        return GATEWAY_STATS_OK_BODY
+    
+    def _post_acknowledge_alert(self, payload: Any) -> Any:
+        if not isinstance(payload, dict):
+            raise BadRequest('Expected a JSON object with "id" or "ids"')
+        if 'ids' in payload:
+            alert_ids = payload['ids']
+            if not isinstance(alert_ids, list):
+                raise BadRequest("'ids' must be a list of alert ids")
+        elif 'id' in payload:
+            alert_ids = [payload['id']]
+        else:
+            raise BadRequest('Missing "id" or "ids"')
+        for alert_id in alert_ids:
+            # bool é subclasse de int, mas true/false não são ids
+            if not isinstance(alert_id, int) or isinstance(alert_id, bool) \
+                    or not SQLITE_INT_MIN <= alert_id <= SQLITE_INT_MAX:
+                raise BadRequest(f'Invalid alert id: {alert_id!r}')
+        acknowledge_alerts(alert_ids)
+        return SUCCESS_BODY
+    
+    # ---- GET routes (recebem a query string já decodificada; bytes = JSON pronto) ----
+    
+    def _get_data(self, query: Dict[str, List[str]]) -> Any:
+        return recent_data_json(100)
+    
+    def _get_alerts(self, query: Dict[str, List[str]]) -> Any:
+        return alerts_json(50, False)
+    
+    def _get_unacknowledged_alerts(self, query: Dict[str, List[str]]) -> Any:
+        return alerts_json(50, True)
+    
+    def _get_history(self, query: Dict[str, List[str]]) -> Any:
+        hours = _int_param(query, 'hours', 24, minimum=1, maximum=HISTORY_MAX_HOURS)
+        bucket_seconds = _int_param(query, 'bucket_seconds', history_bucket_seconds(hours),
+                                    minimum=0, maximum=hours * 3600)
+        return historical_data_json(hours, bucket_seconds)
+    
+    def _get_gateway_stats(self, query: Dict[str, List[str]]) -> Any:
+        return get_cached_gateway_stats()
+    
+    def _get_gateway_stats_history(self, query: Dict[str, List[str]]) -> Any:
+        return gateway_stats_history_json(1, 100)
+    
+    def _get_stats(self, query: Dict[str, List[str]]) -> Any:
+        return active_nodes_json()
+    
+    def _get_health(self, query: Dict[str, List[str]]) -> Any:
+        return HEALTH_BODY
+    
+    POST_ROUTES: Dict[str, Callable[..., Any]] = {
+        '/data': _post_sensor_data,
+        '/api/sensor-data': _post_sensor_data,
+        '/api/gateway-stats': _post_gateway_stats,
+        '/api/alerts/acknowledge': _post_acknowledge_alert,
+    }
+    
+    GET_ROUTES: Dict[str, Callable[..., Any]] = {
+        '/data': _get_data,
+        '/api/alerts': _get_alerts,
+        '/api/alerts/unacknowledged': _get_unacknowledged_alerts,
+        '/api/history': _get_history,
+        '/api/gateway-stats': _get_gateway_stats,
+        '/api/gateway-stats/history': _get_gateway_stats_history,
+        '/api/stats': _get_stats,
+        '/health': _get_health,
+    }
+    
+    def do_POST(self) -> None:
+        """Handle POST requests for sensor data"""
+        handler = self.POST_ROUTES.get(urlsplit(self.path).path)
+        if handler is None:
+            self._send_error_body(404, 'Not Found', b'')
+            return
         
-        elif self.path == '/api/gateway-stats/history':
-            try:
-                history = fetch_gateway_stats_history(1, 100)
-                self.send_response(200)
-                self.send_header('Content-type', 'application/json')
-                self.send_header('Access-Control-Allow-Origin', '*')
-                self.end_headers()
-                self.wfile.write(json.dumps(history).encode())
-            except Exception as e:
-                self.send_response(500, 'Internal Server Error')
-                self.end_headers()
-                self.wfile.write(f'Server error: {e}'.encode())
+        body = self._read_body()
+        if body is None:
+            return
+        try:
+            payload = loads_json(body)
+        except ValueError as e:  # JSONDecodeError e UnicodeDecodeError (corpo não UTF-8)
+            logger.error('Invalid JSON on %s: %s', self.path, e)
+            self._send_error_body(400, 'Bad Request', b'Invalid JSON')
+            return
         
-        elif self.path == '/api/stats':
-            try:
-                active_nodes = fetch_active_nodes_count()
-                self.send_response(200)
-                self.send_header('Content-type', 'application/json')
-                self.send_header('Access-Control-Allow-Origin', '*')
-                self.end_headers()
-                self.wfile.write(json.dumps({'active_nodes': active_nodes}).encode())
-            except Exception as e:
-                self.send_response(500, 'Internal Server Error')
-                self.end_headers()
-                self.wfile.write(f'Server error: {e}'.encode())
+        self._wrap_json(handler, payload)
+
+    def do_GET(self) -> None:
+        """Handle GET requests"""
+        logger.debug('GET %s from %s', self.path, self.client_address[0])
         
-        elif self.path == '/health':
-            self.send_response(200)
-            self.send_header('Content-type', 'application/json')
-            self.end_headers()
-            self.wfile.write(json.dumps({'status': 'ok'}).encode())
+        url = urlsplit(self.path)
+        handler = self.GET_ROUTES.get(url.path)
+        if handler is not None:
+            self._wrap_json(handler, parse_qs(url.query))
+            return
         
-        elif self.path == '/api/sensor-data':
+        if url.path == '/':
+            self.path = '/dashboard.html'
+        elif url.path == '/api/sensor-data':
             self.send_response(200)
             self.send_header('Content-type', 'text/html')
-            self.end_headers()
-            info = b"""
-            <html>
-            <head><title>API Endpoint</title></head>
-            <body>
-                <h1>Sensor Data API</h1>
-                <p>This endpoint accepts POST requests with sensor data.</p>
-                <p>Send data in JSON format to: <code>POST /api/sensor-data</code></p>
-                <p><a href="/data">View recent data (GET /data)</a></p>
-            </body>
-            </html>
-            """
-            self.wfile.write(info)
+            self._send_bytes(API_INFO_HTML)
+            return
         
-        else:
-            super().do_GET()
+        super().do_GET()
+    
+    def log_request(self, code='-', size='-'):
+        """Skip the per-request access log; error branches log with context"""
     
     def log_message(self, format, *args):
-        """Override to customize logging"""
-        # Only log errors, not every request
-        if args[1][0] in ['4', '5']:  # 4xx and 5xx errors
-            super().log_message(format, *args)
+        """Route http.server's own error messages to the logger (formatted lazily)"""
+        logger.warning('%s - ' + format, self.address_string(), *args)
+    
+    def log_error(self, format, *args):
+        """Log idle keep-alive timeouts at debug level; they are routine, not errors"""
+        if format.startswith('Request timed out'):
+            logger.debug('%s - ' + format, self.address_string(), *args)
+            return
+        self.log_message(format, *args)
+
+
+def _int_param(query: Dict[str, List[str]], name: str, default: int,
+               minimum: int = None, maximum: int = None) -> int:
+    """Read an integer query-string parameter, rejecting malformed or out-of-range values"""
+    values = query.get(name)
+    if not values:
+        return default
+    try:
+        value = int(values[0])
+    except ValueError:
+        raise BadRequest(f'Invalid integer for {name!r}: {values[0]!r}') from None
+    if (minimum is not None and value < minimum) or (maximum is not None and value > maximum):
+        raise BadRequest(f'{name!r} must be between {minimum} and {maximum}, got {value}')
+    return value
+
+
+class SensorHTTPServer(http.server.ThreadingHTTPServer):
+    """Threaded HTTP server: one daemon thread per request, reusable address"""
+    
+    daemon_threads = True
+    allow_reuse_address = True
+    # Backlog maior que o padrão (5) para rajadas de gateways e dashboards
+    request_queue_size = 64
+
+
+def configure_logging(level: int = LOG_LEVEL) -> logging.handlers.QueueListener:
+    """Log through a QueueHandler so console I/O happens on the listener thread"""
+    log_queue: queue.SimpleQueue = queue.SimpleQueue()
+    console = logging.StreamHandler()
+    console.setFormatter(logging.Formatter(LOG_FORMAT))
+    listener = logging.handlers.QueueListener(log_queue, console, respect_handler_level=True)
+    root = logging.getLogger()
+    root.handlers[:] = [logging.handlers.QueueHandler(log_queue)]
+    root.setLevel(level)
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
 
 
 def start_server() -> None:
     """Start the HTTP server"""
-    global server_start_time
-    server_start_time = datetime.utcnow()  # Registrar tempo de início do servidor
+    mark_server_start()  # Registrar tempo de início do servidor
+    configure_logging()
     
     initialize_database()
+    load_gateway_stats_cache()
+    
+    start_background_writers()
     
-    with socketserver.TCPServer((HOST, PORT), SensorServerHandler) as httpd:
+    with SensorHTTPServer((HOST, PORT), SensorServerHandler) as httpd:
         print(f"\n{'='*60}")
         print(f"  Sensor Data Server")
         print(f"{'='*60}")
@@ -599,6 +1342,12 @@ def start_server() -> None:
             httpd.serve_forever()
         except KeyboardInterrupt:
             print("\n\n✓ Server stopped.")
+        finally:
+            _gateway_flush_stop.set()
+            _maintenance_stop.set()
+            flush_sensor_queue()
+            flush_gateway_stats()
+            run_maintenance()
 
 
 if __name__ == "__main__":